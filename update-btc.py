@@ -9,9 +9,12 @@
 # Works only on Linux
 
 import argparse, re, sys, platform, os, signal, subprocess, \
-       shlex, hashlib, shutil, tarfile, time, json
+       shlex, hashlib, shutil, tarfile, time, json, select, io, threading
 from urllib.request import urlopen, Request, URLError
+from http.client import HTTPException
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 HOME_PATH        = os.path.expanduser('~') + '/'
 TARS_PATH        = HOME_PATH + 'tars/'
@@ -23,6 +26,12 @@ START_SECS       = 2
 COLUMN_WIDTH     = 14
 ACTIONS_WIDTH    = 56
 FAILED           = 'Failed'
+PROBE_WORKERS    = 8
+BUFFER_SIZE      = 1 << 20
+DOWNLOAD_WORKERS = 4
+MACHINE          = platform.machine() # same as 'uname -m'
+GCC_ARCHS        = {'i686': 'i686-pc-linux-gnu'}
+GO_ARCHS         = {'i686': '386', 'x86_64': 'amd64', 'aarch64': 'arm64'}
 
 BTC_INSTALL_PATH = HOME_PATH + 'opt/bitcoin/'
 BTC_DAEMON_BIN   = 'bitcoind'
@@ -36,6 +45,14 @@ LND_DAEMON_BIN   = 'lnd'
 LND_CLIENT_BIN   = 'lncli'
 LND_API_URL      = 'https://api.github.com/repos/lightningnetwork/lnd/releases/latest'
 
+BTC_CLIENT_VER_RE     = re.compile(r'^Bitcoin Core RPC client version v(.*)\n')
+BTC_DAEMON_VER_RE     = re.compile(r'^Bitcoin Core (?:Daemon )?version v(.*)\n')
+LND_DAEMON_VER_RE     = re.compile(r'^lnd version .* commit=v(.*)\n')
+SATOSHI_SUBVERSION_RE = re.compile(r'^/Satoshi:(.*)/')
+LND_COMMIT_RE         = re.compile(r'^\S+ commit=v(\S+)$')
+LND_TAG_RE            = re.compile(r'v([0-9\.]*)-(.*)')
+BTC_HREF_RE           = re.compile('<a href="{}([0-9.]*)/">.*</a>'.format(BTC_WEB_PREFIX))
+
 Daemon = namedtuple('Daemon', 'keyId keyUrl checksumFilePat remoteUrlPat tarPattern')
 
 BTC = Daemon(
@@ -53,86 +70,248 @@ LND = Daemon(
     tarPattern = 'lnd-linux-{1}-{0}.tar.gz')
 
 def sh(s, out=subprocess.PIPE):
+    checkInterrupted()
+    if out is None and hasattr(output, 'buffer'):
+        # A concurrent update can't share the terminal, send it to the buffer instead
+        p = subprocess.run(shlex.split(s), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        say(p.stdout.decode().strip())
+        return p
     return subprocess.run(shlex.split(s), stdout=out, stderr=subprocess.PIPE)
 
 def shBG(s):
     return subprocess.Popen(shlex.split(s), stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT).pid
 
-def getComm(pid):
+def readComm(path, dirFd=None):
     try:
-        with open(os.path.join('/proc', str(pid), 'comm'), 'r') as filein:
-            return filein.read().strip()
+        fd = os.open(path, os.O_RDONLY, dir_fd=dirFd)
     except FileNotFoundError:
-        return ''
+        return b''
+    try:
+        return os.read(fd, 64).strip()
+    except ProcessLookupError:
+        return b''
+    finally:
+        os.close(fd)
 
-def getPids(comm):
-    pids = map(int, filter(str.isdigit, os.listdir('/proc')))
-    return set(filter(lambda pid: getComm(pid) == comm, pids))
+def getComm(pid):
+    return readComm('/proc/{}/comm'.format(pid)).decode()
+
+def getPids(comm, first=False):
+    # With first=True stop at the first match, for callers that only need any pid
+    target = comm.encode()
+    pids = set()
+    procFd = os.open('/proc', os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        with os.scandir(procFd) as entries:
+            for entry in entries:
+                if entry.name.isdigit() and readComm(entry.name + '/comm', procFd) == target:
+                    pids.add(int(entry.name))
+                    if first:
+                        break
+    finally:
+        os.close(procFd)
+    return pids
+
+output = threading.local()
+interrupted = threading.Event()
+
+def checkInterrupted():
+    # Ctrl-C only reaches the main thread, workers give up here instead
+    if interrupted.is_set():
+        raise KeyboardInterrupt
+
+def say(*args, **kwargs):
+    # Goes to the calling thread's buffer while updates run concurrently
+    checkInterrupted()
+    print(*args, file=getattr(output, 'buffer', sys.stdout), **kwargs)
+
+def runBuffered(buffer, func, *args):
+    output.buffer = buffer
+    try:
+        return func(*args)
+    finally:
+        del output.buffer
 
 def log(desc, value):
     if desc != '':
-        print((desc + ': ').ljust(ACTIONS_WIDTH), end='', flush=True)
+        say((desc + ': ').ljust(ACTIONS_WIDTH), end='', flush=True)
     if isinstance(value, str):
         if value != '':
-            print(value)
+            say(value)
     elif value:
-        print('OK')
+        say('OK')
     else:
         sys.exit('##### FAILED #####')
 
+remoteFileSizes = {}
+rangeUrls = set() # urls whose server accepts byte ranges
+
 def getRemoteFileSize(url):
+    if url not in remoteFileSizes:
+        try:
+            with urlopen(Request(url, method='HEAD')) as netin:
+                remoteFileSizes[url] = int(netin.getheader('Content-Length'))
+                if netin.getheader('Accept-Ranges', '') == 'bytes':
+                    rangeUrls.add(url)
+        except URLError:
+            return -1
+    return remoteFileSizes[url]
+
+def setRemoteFileSize(url, response):
+    if response.status == 206: # partial content, total size follows the '/'
+        size = response.getheader('Content-Range', '').rpartition('/')[2]
+    else:
+        size = response.getheader('Content-Length', '')
+    if size.isdigit():
+        remoteFileSizes[url] = int(size)
+    if response.status == 206 or response.getheader('Accept-Ranges', '') == 'bytes':
+        rangeUrls.add(url)
+
+def saveRange(url, fd, start, end, progress, index, stop):
+    # progress[index] always holds how far this range got, even if interrupted
+    pos = start
     try:
-        with urlopen(Request(url, method='HEAD')) as netin:
-            return int(netin.getheader('Content-Length'))
-    except URLError:
-        return -1
+        request = Request(url, headers={'Range': 'bytes={}-{}'.format(start, end - 1)})
+        with urlopen(request) as response:
+            if response.status != 206:
+                return
+            while pos < end and not stop.is_set() and not interrupted.is_set() and \
+                  (chunk := response.read(min(BUFFER_SIZE, end - pos))):
+                while chunk:
+                    written = os.pwrite(fd, chunk, pos)
+                    pos += written
+                    progress[index] = pos
+                    chunk = chunk[written:]
+    except (OSError, HTTPException):
+        pass
+
+def preallocate(outfile, size):
+    # Reserving all blocks up front lets the filesystem use contiguous extents
+    try:
+        os.posix_fallocate(outfile.fileno(), 0, size)
+    except OSError:
+        pass
+
+def saveRemoteRanges(url, localPath, size):
+    # Returns the size of the contiguous prefix that was downloaded
+    step = -(-size // DOWNLOAD_WORKERS)
+    bounds = [(start, min(start + step, size)) for start in range(0, size, step)]
+    progress = [start for start, _ in bounds]
+    stop = threading.Event()
+    with open(localPath, 'wb') as outfile:
+        done = 0
+        executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS)
+        try:
+            outfile.truncate(size)
+            preallocate(outfile, size)
+            for i, (start, end) in enumerate(bounds):
+                executor.submit(saveRange, url, outfile.fileno(), start, end, progress, i, stop)
+            executor.shutdown()
+            checkInterrupted()
+        finally:
+            # No worker may write to the fd once it is truncated and closed
+            stop.set()
+            executor.shutdown()
+            # Keep only what can be resumed from
+            for (start, end), pos in zip(bounds, progress):
+                done = pos
+                if pos != end:
+                    break
+            outfile.truncate(done)
+        return done
+
+def saveRemoteStream(url, localPath, currentSize):
+    request = Request(url)
+    if currentSize > 0:
+        request.add_header('Range', 'bytes={}-'.format(currentSize))
+    with urlopen(request) as response:
+        setRemoteFileSize(url, response)
+        offset = currentSize if response.status == 206 else 0
+        # Not preallocated, so even a killed run leaves a .part that is exactly
+        # the bytes received and can be resumed
+        with open(localPath, 'r+b' if offset > 0 else 'wb') as outfile:
+            outfile.seek(offset)
+            while chunk := response.read(BUFFER_SIZE):
+                checkInterrupted()
+                outfile.write(chunk)
 
 def saveRemoteFile(url, localPath, resume):
+    # Data goes to a .part file that only replaces localPath once complete,
+    # so an interrupted run never leaves a full-sized but unfinished localPath
+    partPath = localPath + '.part'
     try:
         log('Retrieving ' + os.path.basename(url), '')
-        request = Request(url)
-        if resume and os.path.isfile(localPath):
-            currentSize = os.stat(localPath).st_size
+        currentSize = 0
+        # Fresh downloads only split into ranges if the size is already known
+        remoteFileSize = remoteFileSizes.get(url, -1)
+        if resume:
             remoteFileSize = getRemoteFileSize(url)
-            if currentSize < remoteFileSize:
-                request.add_header('Range', 'bytes={}-'.format(currentSize))
-            elif currentSize == remoteFileSize:
-                log('', True)
-                return
-        with urlopen(request) as response, \
-             open(localPath, 'ab' if resume else 'wb') as outfile:
-            shutil.copyfileobj(response, outfile)
+            if os.path.isfile(localPath):
+                if os.stat(localPath).st_size == remoteFileSize:
+                    log('', True)
+                    return False
+                os.replace(localPath, partPath) # resume it like any other partial download
+            if os.path.isfile(partPath):
+                currentSize = os.stat(partPath).st_size
+                # Only a killed ranged download leaves a full-size .part,
+                # and its holes can't be told apart from data
+                if currentSize >= remoteFileSize:
+                    currentSize = 0
+        if currentSize == 0 and url in rangeUrls and \
+                remoteFileSize > DOWNLOAD_WORKERS * BUFFER_SIZE:
+            currentSize = saveRemoteRanges(url, partPath, remoteFileSize)
+        if currentSize != remoteFileSize:
+            saveRemoteStream(url, partPath, currentSize)
+        partSize = os.stat(partPath).st_size
+        if partSize != remoteFileSizes.get(url, partSize):
+            log('', False) # the .part stays behind for the next resume
+        os.replace(partPath, localPath)
         log('', True)
-    except URLError:
+        return True
+    except (OSError, HTTPException):
         log('', False)
 
 def getGccArch():
-    machine = platform.machine() # same as 'uname -m'
-    if 'arm' in machine:
+    if 'arm' in MACHINE:
         return 'arm-linux-gnueabihf'
-    elif machine == 'i686':
-        return 'i686-pc-linux-gnu'
-    else: # Works for x86_64 and aarch64. Best guess for unknown.
-        return machine + '-linux-gnu'
+    # Works for x86_64 and aarch64. Best guess for unknown.
+    return GCC_ARCHS.get(MACHINE, MACHINE + '-linux-gnu')
 
 def getGoArch():
-    machine = platform.machine() # same as 'uname -m'
-    if machine == 'i686':
-        return '386'
-    elif machine == 'x86_64':
-        return 'amd64'
-    elif machine == 'aarch64':
-        return 'arm64'
-    elif machine[:3] == 'arm':
-        return 'arm'
-    sys.exit('##### Unknown architecture ' + machine)
+    arch = GO_ARCHS.get(MACHINE) or ('arm' if MACHINE[:3] == 'arm' else None)
+    if arch is None:
+        sys.exit('##### Unknown architecture ' + MACHINE)
+    return arch
+
+def waitPids(pids):
+    poller = select.poll()
+    fds = set()
+    try:
+        for pid in pids:
+            try:
+                fd = os.pidfd_open(pid)
+            except ProcessLookupError:
+                continue
+            fds.add(fd)
+            poller.register(fd, select.POLLIN)
+        while fds:
+            for fd, _ in poller.poll():
+                poller.unregister(fd)
+                fds.discard(fd)
+                os.close(fd)
+    finally:
+        for fd in fds:
+            os.close(fd)
 
 def stopDaemon(daemon, clientPath):
     if sh(clientPath + ' stop').returncode != 0:
         for pid in getPids(daemon):
             os.kill(pid, signal.SIGTERM)
-    while getPids(daemon):
-        time.sleep(RETRY_SECS)
+    try:
+        waitPids(getPids(daemon))
+    except (OSError, AttributeError): # pidfd_open() needs Linux 5.3 and Python 3.9
+        while getPids(daemon):
+            time.sleep(RETRY_SECS)
 
 def restartBtc():
     log('Restarting ' + BTC_DAEMON_BIN, '')
@@ -147,6 +326,7 @@ def restartLnd():
     log('', FAILED if getComm(pid) == '' else True)
 
 def makeLink(src, dest):
+    checkInterrupted()
     src = os.path.normpath(src)
     dest = os.path.normpath(dest)
     if (not os.path.islink(dest)) or os.readlink(dest) != src:
@@ -154,12 +334,13 @@ def makeLink(src, dest):
             os.remove(dest)
         os.symlink(src, dest)
 
+@lru_cache(maxsize=32)
 def getInstalledVersion(path, rexp):
     try:
         p = sh(path + ' --version')
         if p.returncode != 0:
             sys.exit('##### Error getting version of command ' + path)
-        m = re.match(rexp, p.stdout.decode())
+        m = rexp.match(p.stdout.decode())
         if m is None:
             sys.exit('##### Error parsing output of command ' + path)
         return m.group(1)
@@ -172,15 +353,15 @@ def getJson(cmd, rexp, field):
     p = sh(cmd)
     if p.returncode != 0:
         return None
-    m = re.match(rexp, json.loads(p.stdout.decode())[field])
+    m = rexp.match(json.loads(p.stdout)[field])
     if m is None:
         sys.exit('##### Error parsing json value returned by ' + cmd)
     return m.group(1)
 
 def getRunningBtc():
-    while getPids(BTC_DAEMON_BIN):
+    while getPids(BTC_DAEMON_BIN, True):
         ver = getJson(BIN_PATH + BTC_CLIENT_BIN + ' getnetworkinfo',
-                      r'^/Satoshi:(.*)/', 'subversion')
+                      SATOSHI_SUBVERSION_RE, 'subversion')
         if ver is not None:
             return ver
         time.sleep(RETRY_SECS)
@@ -189,33 +370,44 @@ def getRunningLnd():
     # "lncli getinfo" returns 1 if either lnd is not running or if wallet is locked
     # if lnd is not running stderr contains 'the connection in unavailable'
     # if lnd is locked      stderr contains 'Wallet is encrypted'
-    ver = getJson(BIN_PATH + LND_CLIENT_BIN + ' getinfo', r'^\S+ commit=v(\S+)$', 'version')
+    ver = getJson(BIN_PATH + LND_CLIENT_BIN + ' getinfo', LND_COMMIT_RE, 'version')
     if ver:
         return ver
-    elif getPids(LND_DAEMON_BIN):
+    elif getPids(LND_DAEMON_BIN, True):
         return 'locked'
     else:
         return None
 
 def getExpectedChecksum(checksumFilePath, fileName):
-    try:
-        with open(checksumFilePath, 'r') as filein:
-            lines = filein.read().splitlines()
+    checksum = None
+    with open(checksumFilePath, 'r') as filein:
+        for line in filein:
+            line = line.rstrip('\n')
+            if line == '-----BEGIN PGP SIGNED MESSAGE-----':
+                checksum = None # only the signed part counts
+                continue
+            elif line == '-----BEGIN PGP SIGNATURE-----':
+                break
+            # Format is 64 hex digits, spaces, file name
+            if len(line) < 66 or line[64] != ' ' or line[65:].lstrip(' ') != fileName:
+                continue
             try:
-                begin = lines.index('-----BEGIN PGP SIGNED MESSAGE-----')
-                end   = lines.index('-----BEGIN PGP SIGNATURE-----')
-                lines = lines[(begin + 1):end]
+                if len(bytes.fromhex(line[:64])) != 32:
+                    continue
             except ValueError:
-                pass
-            p = re.compile(r'^([0-9a-fA-F]{64})[ ]+' + re.escape(fileName) + '$')
-            hashes = [m.group(1) for m in map(p.match, lines)
-                                 if m is not None]
-            if len(hashes) > 0 and all(x == hashes[0] for x in hashes[1:]):
-                return hashes[0]
-            else:
+                continue
+            if checksum is None:
+                checksum = line[:64]
+            elif checksum != line[:64]:
                 return None
-    except IndexError:
-        return None
+    return checksum
+
+def advise(filein, advice):
+    # Only a hint, so it must never fail the read it's advising on
+    try:
+        os.posix_fadvise(filein.fileno(), 0, 0, advice)
+    except OSError:
+        pass
 
 def installTar(tarPath, instDir):
     try:
@@ -225,34 +417,63 @@ def installTar(tarPath, instDir):
         elif os.path.lexists(instDir):
             os.remove(instDir)
         os.makedirs(instDir, exist_ok=False)
-        with tarfile.open(tarPath, errorlevel=2) as tar:
-            for member in tar.getmembers():
-                if os.path.dirname(member.name) != '':
-                    member.name = '/'.join(member.name.split('/')[1:])
-                    tar.extract(member, instDir)
+        with open(tarPath, 'rb') as filein:
+            advise(filein, os.POSIX_FADV_SEQUENTIAL)
+            with tarfile.open(fileobj=filein, mode='r:gz', errorlevel=2) as tar:
+                for member in tar: # parses headers lazily, unlike getmembers()
+                    if os.path.dirname(member.name) != '':
+                        member.name = '/'.join(member.name.split('/')[1:])
+                        tar.extract(member, instDir)
+            # Extraction is the last reader of the archive
+            advise(filein, os.POSIX_FADV_DONTNEED)
             return True
     except (OSError, tarfile.ExtractError):
         return False
 
+def fsyncPath(path, flags):
+    fd = os.open(path, flags)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def syncDir(path):
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                syncDir(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                fsyncPath(entry.path, os.O_RDONLY)
+    fsyncPath(path, os.O_RDONLY | os.O_DIRECTORY)
+
+def syncTree(path):
+    # Unlike os.sync() this doesn't wait for unrelated dirty pages system-wide
+    path = os.path.normpath(path)
+    syncDir(path)
+    fsyncPath(os.path.dirname(path), os.O_RDONLY | os.O_DIRECTORY)
+
 def runGPG(args):
-    return sh('gpg --batch --logger-fd 1 --trust-model always ' + args)
+    return sh('gpg --batch --logger-fd 1 --status-fd 1 --trust-model always ' + args)
 
 def haveKey(key):
     return runGPG('-k ' + key).returncode == 0
 
+def importedKey(p, key):
+    # gpg reports "[GNUPG:] IMPORT_OK <reason> <fingerprint>" for every key it now holds
+    return any(line.split()[1:2] == [b'IMPORT_OK'] and line.split()[3:4] == [key.upper().encode()]
+               for line in p.stdout.upper().splitlines())
+
 def retrievePublicKey(keyId, keyUrl):
     if haveKey(keyId):
         return
     if keyUrl is not None:
         log('Importing key ' + keyUrl, '')
-        runGPG('--fetch-keys ' + keyUrl)
-        if haveKey(keyId):
+        if importedKey(runGPG('--fetch-keys ' + keyUrl), keyId):
             log('', True)
             return
         log('', FAILED)
     log('Importing key from gpg server', '')
-    runGPG('--recv-keys ' + keyId)
-    log('', haveKey(keyId))
+    log('', importedKey(runGPG('--recv-keys ' + keyId), keyId))
 
 def verifyGPG(sigPath, dataPath):
     data = '' if dataPath is None or sigPath == dataPath else dataPath
@@ -261,16 +482,23 @@ def verifyGPG(sigPath, dataPath):
 def checkSha256(filePath, sha256sum):
     try:
         with open(filePath, 'rb') as filein:
-            return hashlib.sha256(filein.read()).hexdigest().lower() == sha256sum.lower()
+            advise(filein, os.POSIX_FADV_SEQUENTIAL)
+            h = hashlib.sha256()
+            while chunk := filein.read(BUFFER_SIZE):
+                h.update(chunk)
+            return h.hexdigest().lower() == sha256sum.lower()
     except OSError:
         return False
 
 def verifyChecksum(checksum, filePath, url):
     if checkSha256(filePath, checksum):
         return True
-    else:
-        saveRemoteFile(url, filePath, True)
-        return checkSha256(filePath, checksum)
+    # Only hash again if resuming actually changed the file
+    if saveRemoteFile(url, filePath, True) and checkSha256(filePath, checksum):
+        return True
+    # A complete but corrupt file can't be resumed, fetch it again from scratch
+    saveRemoteFile(url, filePath, False)
+    return checkSha256(filePath, checksum)
 
 def getValidatedArchive(version, arch, data):
     checksumFile = data.checksumFilePat.format(version)
@@ -283,13 +511,16 @@ def getValidatedArchive(version, arch, data):
     rootUrl = data.remoteUrlPat.format(version)
     postfix = '.sig' if e != '.asc' else ''
     sig = sigData + postfix
-    if not verifyGPG(sig, sigData):
+    # No point spawning gpg for files that haven't been downloaded yet
+    sigOk = os.path.isfile(sig) and os.path.isfile(sigData) and verifyGPG(sig, sigData)
+    if not sigOk:
         retrievePublicKey(data.keyId, data.keyUrl)
         saveRemoteFile(rootUrl + checksumFile + postfix, sig, False)
         if postfix:
             saveRemoteFile(rootUrl + checksumFile, sigData, False)
-        if not verifyGPG(sig, sigData):
-            return None
+        sigOk = verifyGPG(sig, sigData)
+    if not sigOk:
+        return None
     fileName = data.tarPattern.format(version, arch)
     checksum = getExpectedChecksum(sigData, fileName)
     if verifyChecksum(checksum, TARS_PATH + fileName, rootUrl + fileName):
@@ -318,22 +549,28 @@ def getLatestBtc():
         with urlopen(BTC_ROOT_URL) as netin:
             exists = lambda ver: getRemoteFileSize(BTC_ROOT_URL + BTC_WEB_PREFIX +
                                                    ver + '/' + BTC.checksumFilePat) > 0
-            versions = re.findall('<a href="{}([0-9.]*)/">.*</a>'.format(BTC_WEB_PREFIX),
-                                  netin.read().decode())
-            sortedVersions = sorted(versions,
-                                    key=lambda ver: [int(x) for x in ver.split('.')],
-                                    reverse = True)
-            return next(filter(exists, sortedVersions), None)
+            versions = BTC_HREF_RE.findall(netin.read().decode())
+            keyed = [(tuple(map(int, ver.split('.'))), ver) for ver in versions]
+            keyed.sort(reverse = True)
+            sortedVersions = [ver for _, ver in keyed]
+        # Probe a batch of candidates at once, then pick the highest existing one
+        with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as executor:
+            for i in range(0, len(sortedVersions), PROBE_WORKERS):
+                batch = sortedVersions[i:(i + PROBE_WORKERS)]
+                for ver, found in zip(batch, executor.map(exists, batch)):
+                    if found:
+                        return ver
+        return None
     except URLError:
         sys.exit('##### Error retrieving ' + BTC_ROOT_URL)
 
 def getInstalledBtcClientVersion(path):
     return getInstalledVersion(path + 'bin/' + BTC_CLIENT_BIN,
-                               r'^Bitcoin Core RPC client version v(.*)\n')
+                               BTC_CLIENT_VER_RE)
 
 def getInstalledBtcDaemonVersion(path):
     return getInstalledVersion(path + 'bin/' + BTC_DAEMON_BIN,
-                               r'^Bitcoin Core (?:Daemon )?version v(.*)\n')
+                               BTC_DAEMON_VER_RE)
 
 def updateBtc(restart, runTests):
     arch = getGccArch()
@@ -341,7 +578,7 @@ def updateBtc(restart, runTests):
     installedVer = getInstalledBtcDaemonVersion(installLink)
     latestVer = getLatestBtc()
     if installedVer != latestVer:
-        print('Upgrading bitcoind from {} to {}'.format(installedVer, latestVer))
+        say('Upgrading bitcoind from {} to {}'.format(installedVer, latestVer))
         fileName = getValidatedArchive(latestVer, arch, BTC)
         log('Signature of ' + latestVer, fileName is not None)
         log('Extracting archive', '')
@@ -351,13 +588,14 @@ def updateBtc(restart, runTests):
         testBinPath = instDir + 'bin/' + BTC_TEST_BIN
         if runTests and os.path.isfile(testBinPath):
             p = sh(testBinPath, None)
-            print(p.stderr.decode().strip())
+            say(p.stderr.decode().strip())
             if p.returncode != 0:
                 sys.exit(p.returncode)
         if latestVer == getInstalledBtcDaemonVersion(instDir) == \
                         getInstalledBtcClientVersion(instDir):
-            os.sync() # make sure all newly installed files are synced before switching
+            syncTree(instDir) # make sure all newly installed files are synced before switching
             makeLink(dirName, installLink)
+            getInstalledVersion.cache_clear()
             createBtcLinks(arch)
             installedVer = latestVer
         else:
@@ -367,7 +605,7 @@ def updateBtc(restart, runTests):
     return (BTC_DAEMON_BIN, latestVer, installedVer, getRunningBtc())
 
 def lndTagToVersion(tag):
-    m = re.match(r'v([0-9\.]*)-(.*)', tag)
+    m = LND_TAG_RE.match(tag)
     if m is None:
         sys.exit('##### Error parsing lnd tag \'{}\''.format(tag))
     ver = m.group(1)
@@ -376,13 +614,13 @@ def lndTagToVersion(tag):
 def getLatestLndTag():
     try:
         with urlopen(LND_API_URL) as netin:
-            return json.loads(netin.read().decode())['tag_name']
+            return json.load(netin)['tag_name']
     except URLError:
         sys.exit('##### Error retrieving ' + LND_API_URL)
 
 def getInstalledLndDaemonVersion(path):
     return getInstalledVersion(path + LND_DAEMON_BIN,
-                               r'^lnd version .* commit=v(.*)\n')
+                               LND_DAEMON_VER_RE)
 
 def updateLnd(restart):
     installLink = LND_INSTALL_PATH + LINK_NAME + '/'
@@ -390,7 +628,7 @@ def updateLnd(restart):
     installedVer = getInstalledLndDaemonVersion(installLink)
     latestVer = lndTagToVersion(latestTag)
     if installedVer != latestVer:
-        print('Upgrading lnd from {} to {}'.format(installedVer, latestVer))
+        say('Upgrading lnd from {} to {}'.format(installedVer, latestVer))
         arch = getGoArch()
         fileName = getValidatedArchive(latestTag, arch, LND)
         log('Signature of ' + latestVer, fileName is not None)
@@ -399,8 +637,9 @@ def updateLnd(restart):
         instDir = LND_INSTALL_PATH + dirName + '/'
         log('', installTar(fileName, instDir))
         if latestVer != getInstalledLndDaemonVersion(installLink):
-            os.sync() # make sure all newly installed files are synced before switching
+            syncTree(instDir) # make sure all newly installed files are synced before switching
             makeLink(dirName, installLink)
+            getInstalledVersion.cache_clear()
             createLndLinks()
             installedVer = latestVer
     if restart and getRunningLnd() != installedVer:
@@ -417,10 +656,39 @@ def main():
     args = parser.parse_args()
     os.makedirs(TARS_PATH, exist_ok=True)
     table = [('', 'Latest', 'Installed', 'Running')]
+    tasks = []
     if not args.l:
-        table.append(updateBtc(args.r, not args.s))
+        tasks.append((updateBtc, args.r, not args.s))
     if not args.b:
-        table.append(updateLnd(args.r))
+        tasks.append((updateLnd, args.r))
+    if len(tasks) == 1:
+        table.append(tasks[0][0](*tasks[0][1:]))
+    else:
+        # Both updates are mostly network bound, run them concurrently
+        # but print each one's output in order once it's done
+        buffers = [io.StringIO() for _ in tasks]
+        shown = 0
+        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            futures = [executor.submit(runBuffered, buffer, *task)
+                       for buffer, task in zip(buffers, tasks)]
+            try:
+                for buffer, future in zip(buffers, futures):
+                    error = future.exception() # wait without raising
+                    print(buffer.getvalue(), end='', flush=True)
+                    shown += 1
+                    if isinstance(error, SystemExit) and isinstance(error.code, str):
+                        print(error.code, file=sys.stderr, flush=True)
+                        error.code = 1 # already shown, keep only the exit status
+            except KeyboardInterrupt:
+                # Stop the workers at their next step, then show what they got done
+                interrupted.set()
+                executor.shutdown()
+                for buffer in buffers[shown:]:
+                    text = buffer.getvalue()
+                    print(text, end='\n' if text and not text.endswith('\n') else '', flush=True)
+                raise
+        # Only raise a failure once everything each task did has been shown
+        table.extend(future.result() for future in futures)
     for rowno in range(0, len(table[0])):
         print(''.join(str(cols[rowno]).ljust(COLUMN_WIDTH) for cols in table))
 